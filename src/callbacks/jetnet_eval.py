@@ -162,17 +162,17 @@ class JetNetEvaluationCallback(pl.Callback):
         if log:
             # Get background data for plotting and calculating Wasserstein distances
             if self.data_type == "test":
-                background_data = np.array(trainer.datamodule.tensor_test)[: self.num_jet_samples]
-                background_mask = np.array(trainer.datamodule.mask_test)[: self.num_jet_samples]
-                background_cond = np.array(trainer.datamodule.tensor_conditioning_test)[
+                background_data = trainer.datamodule.tensor_test[: self.num_jet_samples].numpy()
+                background_mask = trainer.datamodule.mask_test[: self.num_jet_samples].numpy()
+                background_cond = trainer.datamodule.tensor_conditioning_test[
                     : self.num_jet_samples
-                ]
+                ].numpy()
             elif self.data_type == "val":
-                background_data = np.array(trainer.datamodule.tensor_val)[: self.num_jet_samples]
-                background_mask = np.array(trainer.datamodule.mask_val)[: self.num_jet_samples]
-                background_cond = np.array(trainer.datamodule.tensor_conditioning_val)[
+                background_data = trainer.datamodule.tensor_val[: self.num_jet_samples].numpy()
+                background_mask = trainer.datamodule.mask_val[: self.num_jet_samples].numpy()
+                background_cond = trainer.datamodule.tensor_conditioning_val[
                     : self.num_jet_samples
-                ]
+                ].numpy()
 
             mask = background_mask
             cond = background_cond
@@ -198,9 +198,9 @@ class JetNetEvaluationCallback(pl.Callback):
             data, generation_time = generate_data(
                 model=pl_module,
                 num_jet_samples=len(mask),
-                cond=torch.tensor(cond),
+                cond=torch.from_numpy(np.ascontiguousarray(cond, dtype=np.float32)),
                 variable_set_sizes=trainer.datamodule.hparams.variable_jet_sizes,
-                mask=torch.tensor(mask),
+                mask=torch.from_numpy(np.ascontiguousarray(mask, dtype=np.float32)),
                 normalized_data=trainer.datamodule.hparams.normalize,
                 means=trainer.datamodule.means,
                 stds=trainer.datamodule.stds,
@@ -241,7 +241,7 @@ class JetNetEvaluationCallback(pl.Callback):
                 efps_values,
                 pt_selected_particles,
                 pt_selected_multiplicities,
-            ) = prepare_data_for_plotting(np.array([data]), **plot_prep_config)
+            ) = prepare_data_for_plotting(data[None], **plot_prep_config)
 
             (
                 jet_data_sim,
@@ -261,7 +261,7 @@ class JetNetEvaluationCallback(pl.Callback):
             # Plotting
             plot_name = f"{self.model_name}--epoch{trainer.current_epoch}"
             fig = plot_data(
-                particle_data=np.array([data]),
+                particle_data=data[None],
                 sim_data=background_data,
                 jet_data_sim=jet_data_sim,
                 jet_data=jet_data,
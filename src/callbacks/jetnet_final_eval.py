@@ -3,9 +3,13 @@
 Specific to JetNet dataset.
 """
 
+import multiprocessing
+from contextlib import ExitStack
+from pathlib import Path
 from typing import Mapping, Optional
 
 import h5py
+import hdf5plugin  # noqa: F401, registers the Blosc2 filter used for the substructure files
 import numpy as np
 import pytorch_lightning as pl
 import torch
@@ -13,7 +17,7 @@ import wandb
 import yaml
 
 from src.data.components import calculate_all_wasserstein_metrics, normalize_tensor
-from src.data.components.metrics import wasserstein_distance_batched
+from src.data.components.metrics import wasserstein_distances_batched
 from src.utils.data_generation import generate_data
 from src.utils.jet_substructure import dump_hlvs
 from src.utils.plotting import (
@@ -29,6 +33,35 @@ from .ema import EMA, EMAModelCheckpoint
 
 log = get_pylogger("JetNetFinalEvaluationCallback")
 
+# use the libyaml C emitter if PyYAML was built with it
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+class CometAdapter:
+    """Log images and metrics to a Comet experiment."""
+
+    def __init__(self, experiment):
+        self.experiment = experiment
+
+    def log_image(self, path: str, name: str) -> None:
+        self.experiment.log_image(path, name=name)
+
+    def log_metrics(self, metrics: Mapping) -> None:
+        self.experiment.log_metrics(metrics)
+
+
+class WandbAdapter:
+    """Log images and metrics to a Weights & Biases run."""
+
+    def __init__(self, run):
+        self.run = run
+
+    def log_image(self, path: str, name: str) -> None:
+        self.run.log({name: wandb.Image(path)})
+
+    def log_metrics(self, metrics: Mapping) -> None:
+        self.run.log(metrics)
+
 
 # TODO cond_path is currently only working for mass and pt
 class JetNetFinalEvaluationCallback(pl.Callback):
@@ -132,9 +165,19 @@ class JetNetFinalEvaluationCallback(pl.Callback):
         return ema_callback
 
     def on_test_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
+        # resources registered in the exit stack are released even if the evaluation fails
+        with ExitStack() as exit_stack:
+            self._evaluate(trainer, pl_module, exit_stack)
+
+    def _evaluate(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule, exit_stack: ExitStack
+    ) -> None:
+        """Generate data with the selected checkpoint, calculate metrics and log plots."""
         log.info(f"Evaluating model on {self.dataset} dataset.")
 
         ckpt = self._get_checkpoint(trainer, use_last_checkpoint=self.use_last_checkpoint)
+        # all outputs are saved in the run directory that contains the checkpoint folder
+        output_dir = Path(ckpt).parent.parent
 
         log.info(f"Loading checkpoint from {ckpt}")
         model = pl_module.load_from_checkpoint(ckpt)
@@ -145,45 +188,49 @@ class JetNetFinalEvaluationCallback(pl.Callback):
 
         # load conditioning data if provided
         if self.cond_path is not None:
-            with h5py.File(self.cond_path) as f:
-                pt_c = f["pt"][:]
-                mass_c = f["mass"][:]
-                num_particles_c = f["num_particles"][:].squeeze()
+            with h5py.File(self.cond_path, "r") as f:
+                # read directly into preallocated buffers to avoid intermediate copies
+                pt_c = np.empty(f["pt"].shape, dtype=np.float32)
+                mass_c = np.empty(f["mass"].shape, dtype=np.float32)
+                num_particles_c = np.empty(
+                    f["num_particles"].shape, dtype=f["num_particles"].dtype
+                )
+                f["pt"].read_direct(pt_c)
+                f["mass"].read_direct(mass_c)
+                f["num_particles"].read_direct(num_particles_c)
+            num_particles_c = num_particles_c.squeeze()
 
             # masking for jet size
             jet_size = trainer.datamodule.hparams.num_particles
-            num_particles_ctemp = np.array(
-                [n if n <= jet_size else jet_size for n in num_particles_c]
-            )
+            # at least one particle per jet, empty masks would produce NaNs in the EPiC pooling
+            num_particles_ctemp = np.clip(num_particles_c.astype(np.int32), 1, jet_size)
 
-            mask_c = np.expand_dims(
-                np.tri(jet_size)[num_particles_ctemp.astype(int) - 1], axis=-1
-            ).astype(np.float32)
+            mask_c = (np.arange(jet_size)[None, :] < num_particles_ctemp[:, None]).astype(
+                np.float32
+            )[..., None]
 
             # get conditioning data
             # TODO implement other conditioning options
+            cond_c = np.concatenate((pt_c, mass_c), axis=-1)
             if trainer.datamodule.num_cond_features != 0:
+                # normalize pt and mass in place on the concatenated array
                 cond_means = np.array(trainer.datamodule.cond_means)
                 cond_stds = np.array(trainer.datamodule.cond_stds)
-                pt_norm = normalize_tensor(pt_c.copy(), [cond_means[0]], [cond_stds[0]])
-                mass_norm = normalize_tensor(mass_c.copy(), [cond_means[1]], [cond_stds[1]])
-                cond_c = np.concatenate((pt_norm, mass_norm), axis=-1)
-            else:
-                cond_c = np.concatenate((pt_c, mass_c), axis=-1)
+                cond_c = normalize_tensor(cond_c, cond_means[:2], cond_stds[:2])
 
         # Get background data for plotting and calculating Wasserstein distances
         if self.dataset == "test":
-            background_data = np.array(trainer.datamodule.tensor_test)[: self.num_jet_samples]
-            background_mask = np.array(trainer.datamodule.mask_test)[: self.num_jet_samples]
-            background_cond = np.array(trainer.datamodule.tensor_conditioning_test)[
+            background_data = trainer.datamodule.tensor_test[: self.num_jet_samples].numpy()
+            background_mask = trainer.datamodule.mask_test[: self.num_jet_samples].numpy()
+            background_cond = trainer.datamodule.tensor_conditioning_test[
                 : self.num_jet_samples
-            ]
+            ].numpy()
         elif self.dataset == "val":
-            background_data = np.array(trainer.datamodule.tensor_val)[: self.num_jet_samples]
-            background_mask = np.array(trainer.datamodule.mask_val)[: self.num_jet_samples]
-            background_cond = np.array(trainer.datamodule.tensor_conditioning_val)[
+            background_data = trainer.datamodule.tensor_val[: self.num_jet_samples].numpy()
+            background_mask = trainer.datamodule.mask_val[: self.num_jet_samples].numpy()
+            background_cond = trainer.datamodule.tensor_conditioning_val[
                 : self.num_jet_samples
-            ]
+            ].numpy()
         if self.cond_path is not None:
             mask = mask_c[: self.num_jet_samples]
             cond = cond_c[: self.num_jet_samples]
@@ -194,38 +241,60 @@ class JetNetFinalEvaluationCallback(pl.Callback):
         # maximum number of samples to plot is the number of samples in the dataset
         num_plot_samples = len(background_data)
 
+        # repeat the dataset via indices instead of copying mask and cond
+        indices = None
+        num_generated_jets = len(mask)
         if self.datasets_multiplier > 1:
-            mask = np.repeat(mask, self.datasets_multiplier, axis=0)
-            cond = np.repeat(cond, self.datasets_multiplier, axis=0)
+            indices = np.repeat(np.arange(len(mask)), self.datasets_multiplier)
+            num_generated_jets = len(indices)
 
-        # Generate data
+        # the reference data is already available, so start its substructure calculation in a
+        # separate process that runs while the model generates data on the GPU
+        # spawn instead of fork because the parent process holds a CUDA context
+        if self.evaluate_substructure:
+            substructure_full_path = str(output_dir / f"substructure{self.suffix}")
+            substructure_full_path_jetnet = str(output_dir / f"substructure_jetnet{self.suffix}")
+            # the pool is terminated when the exit stack closes, also if anything below fails
+            substructure_pool = exit_stack.enter_context(
+                multiprocessing.get_context("spawn").Pool(processes=2)
+            )
+            substructure_results = [
+                substructure_pool.apply_async(
+                    dump_hlvs, (background_data, substructure_full_path_jetnet), {"plot": False}
+                )
+            ]
+
+        # Generate data directly into a memory-mapped .npy file
+        out = np.lib.format.open_memmap(
+            output_dir / f"final_generated_data{self.suffix}.npy",
+            mode="w+",
+            dtype=np.float32,
+            shape=(num_generated_jets, model.hparams.num_particles, model.hparams.features),
+        )
         data, generation_time = generate_data(
             model=model,
-            num_jet_samples=len(mask),
-            cond=torch.tensor(cond),
+            num_jet_samples=num_generated_jets,
+            cond=torch.from_numpy(np.ascontiguousarray(cond, dtype=np.float32)),
             variable_set_sizes=trainer.datamodule.hparams.variable_jet_sizes,
-            mask=torch.tensor(mask),
+            mask=torch.from_numpy(np.ascontiguousarray(mask, dtype=np.float32)),
             normalized_data=trainer.datamodule.hparams.normalize,
             means=trainer.datamodule.means,
             stds=trainer.datamodule.stds,
+            indices=indices,
+            out=out,
             **self.generation_config,
         )
 
-        # save generated data
-        path = "/".join(ckpt.split("/")[:-2]) + "/"
-        file_name = f"final_generated_data{self.suffix}.npy"
-        full_path = path + file_name
-        np.save(full_path, data)
-
         # Wasserstein distances
         metrics = calculate_all_wasserstein_metrics(background_data, data, **self.w_dist_config)
 
         # Prepare Data for Plotting
         data_plotting = data[:num_plot_samples]
+        plot_efps = self.plot_config.get("plot_efps", False)
         plot_prep_config = {
-            "calculate_efps" if key == "plot_efps" else key: value
+            key: value
             for key, value in self.plot_config.items()
-            if key in ["plot_efps", "selected_particles", "selected_multiplicities"]
+            if key in ["selected_particles", "selected_multiplicities"]
         }
 
         (
@@ -233,7 +302,9 @@ class JetNetFinalEvaluationCallback(pl.Callback):
             efps_values,
             pt_selected_particles,
             pt_selected_multiplicities,
-        ) = prepare_data_for_plotting(np.array([data_plotting]), **plot_prep_config)
+        ) = prepare_data_for_plotting(
+            data_plotting[None], calculate_efps=plot_efps, **plot_prep_config
+        )
 
         (
             jet_data_sim,
@@ -242,6 +313,7 @@ class JetNetFinalEvaluationCallback(pl.Callback):
             pt_selected_multiplicities_sim,
         ) = prepare_data_for_plotting(
             [background_data],
+            calculate_efps=plot_efps,
             **plot_prep_config,
         )
         jet_data_sim, efps_sim, pt_selected_particles_sim = (
@@ -249,12 +321,14 @@ class JetNetFinalEvaluationCallback(pl.Callback):
             efps_sim[0],
             pt_selected_particles_sim[0],
         )
+        if not plot_efps:
+            efps_values = efps_sim = None
 
         # Plotting
         plot_name = f"final_plot{self.suffix}"
-        img_path = "/".join(ckpt.split("/")[:-2]) + "/"
+        img_path = f"{output_dir}/"
         fig = plot_data(
-            particle_data=np.array([data_plotting]),
+            particle_data=data_plotting[None],
             sim_data=background_data,
             jet_data_sim=jet_data_sim,
             jet_data=jet_data,
@@ -272,64 +346,50 @@ class JetNetFinalEvaluationCallback(pl.Callback):
             **self.plot_config,
         )
 
+        images = {}
         if self.evaluate_substructure:
-            substructure_path = "/".join(ckpt.split("/")[:-2]) + "/"
-            substructure_file_name = f"substructure{self.suffix}"
-            substructure_full_path = substructure_path + substructure_file_name
-
-            # calculate substructure for generated data
-            dump_hlvs(data, substructure_full_path, plot=False)
-
-            substructure_path_jetnet = "/".join(ckpt.split("/")[:-2]) + "/"
-            substructure_file_name_jetnet = f"substructure_jetnet{self.suffix}"
-            substructure_full_path_jetnet = (
-                substructure_path_jetnet + substructure_file_name_jetnet
+            # calculate substructure for generated data next to the reference data
+            substructure_results.append(
+                substructure_pool.apply_async(
+                    dump_hlvs, (data, substructure_full_path), {"plot": False}
+                )
             )
-
-            # calculate substructure for reference data
-            dump_hlvs(background_data, substructure_full_path_jetnet, plot=False)
+            for result in substructure_results:
+                result.get()
 
             # load substructure for model generated data
-            keys = []
-            data_substructure = []
             with h5py.File(substructure_full_path + ".h5", "r") as f:
-                tau21 = np.array(f["tau21"])
-                tau32 = np.array(f["tau32"])
-                d2 = np.array(f["d2"])
-                for key in f.keys():
-                    keys.append(key)
-                    data_substructure.append(np.array(f[key]))
-            keys = np.array(keys)
-            data_substructure = np.array(data_substructure)
+                subs = {key: f[key][...] for key in f.keys()}
+            tau21, tau32, d2 = subs["tau21"], subs["tau32"], subs["d2"]
+            keys = np.array(list(subs))
+            data_substructure = np.stack(list(subs.values()))
 
             # load substructure for JetNet data
-            data_substructure_jetnet = []
             with h5py.File(substructure_full_path_jetnet + ".h5", "r") as f:
-                tau21_jetnet = np.array(f["tau21"])
-                tau32_jetnet = np.array(f["tau32"])
-                d2_jetnet = np.array(f["d2"])
-                for key in f.keys():
-                    data_substructure_jetnet.append(np.array(f[key]))
-            data_substructure_jetnet = np.array(data_substructure_jetnet)
-
-            # calculate wasserstein distances
-            w_dist_tau21_mean, w_dist_tau21_std = wasserstein_distance_batched(
-                tau21_jetnet, tau21, **self.w_dist_config
+                subs_jetnet = {key: f[key][...] for key in f.keys()}
+            tau21_jetnet, tau32_jetnet, d2_jetnet = (
+                subs_jetnet["tau21"],
+                subs_jetnet["tau32"],
+                subs_jetnet["d2"],
             )
-            w_dist_tau32_mean, w_dist_tau32_std = wasserstein_distance_batched(
-                tau32_jetnet, tau32, **self.w_dist_config
-            )
-            w_dist_d2_mean, w_dist_d2_std = wasserstein_distance_batched(
-                d2_jetnet, d2, **self.w_dist_config
+            data_substructure_jetnet = np.stack(list(subs_jetnet.values()))
+
+            # calculate wasserstein distances on the GPU if available, otherwise in-process
+            # with the multithreaded kernel, which is faster than starting a worker pool
+            w_dists_substructure = wasserstein_distances_batched(
+                {
+                    "tau21": (tau21_jetnet, tau21),
+                    "tau32": (tau32_jetnet, tau32),
+                    "d2": (d2_jetnet, d2),
+                },
+                device="cuda" if torch.cuda.is_available() else None,
+                **self.w_dist_config,
             )
 
             # add to metrics
-            metrics["w_dist_tau21_mean"] = w_dist_tau21_mean
-            metrics["w_dist_tau21_std"] = w_dist_tau21_std
-            metrics["w_dist_tau32_mean"] = w_dist_tau32_mean
-            metrics["w_dist_tau32_std"] = w_dist_tau32_std
-            metrics["w_dist_d2_mean"] = w_dist_d2_mean
-            metrics["w_dist_d2_std"] = w_dist_d2_std
+            for name, (w_dist_mean, w_dist_std) in w_dists_substructure.items():
+                metrics[f"w_dist_{name}_mean"] = w_dist_mean
+                metrics[f"w_dist_{name}_std"] = w_dist_std
 
             # plot substructure
             file_name_substructure = f"substructure_3plots{self.suffix}"
@@ -356,50 +416,41 @@ class JetNetFinalEvaluationCallback(pl.Callback):
                 close_fig=True,
             )
 
-            # log substructure images
+            # substructure images to log
             img_path_substructure = f"{img_path}{file_name_substructure}.png"
             img_path_substructure_full = f"{img_path}{file_name_full_substructure}.png"
-            if self.comet_logger is not None:
-                self.comet_logger.log_image(
-                    img_path_substructure, name=f"A_final_substructure{self.suffix}"
-                )
-                self.comet_logger.log_image(
-                    img_path_substructure_full, name=f"A_final_substructure_full{self.suffix}"
-                )
-            if self.wandb_logger is not None:
-                self.wandb_logger.log(
-                    {f"A_final_substructure{self.suffix}": wandb.Image(img_path_substructure)}
-                )
-                self.wandb_logger.log(
-                    {
-                        f"A_final_substructure_full{self.suffix}": wandb.Image(
-                            img_path_substructure_full
-                        )
-                    }
-                )
+            images[f"A_final_substructure{self.suffix}"] = img_path_substructure
+            images[f"A_final_substructure_full{self.suffix}"] = img_path_substructure_full
 
-        yaml_path = "/".join(ckpt.split("/")[:-2]) + f"/final_eval_metrics{self.suffix}.yml"
+        yaml_path = output_dir / f"final_eval_metrics{self.suffix}.yml"
         log.info(f"Writing final evaluation metrics to {yaml_path}")
 
         # transform numpy.float64 for better readability in yaml file
         metrics = {k: float(v) for k, v in metrics.items()}
         # write to yaml file
         with open(yaml_path, "w") as outfile:
-            yaml.dump(metrics, outfile, default_flow_style=False)
+            yaml.dump(metrics, outfile, Dumper=YamlDumper, default_flow_style=False)
 
         # rename wasserstein distances for better distinction
         metrics_final = {}
         for key, value in metrics.items():
             metrics_final[key + f"_final{self.suffix}"] = value
 
-        # log metrics and image to loggers
-        img_path_data = f"{img_path}{plot_name}.png"
+        # log metrics and images to loggers
+        images[f"A_final_plot{self.suffix}"] = f"{img_path}{plot_name}.png"
+        for adapter in self._get_logger_adapters():
+            for name, path in images.items():
+                adapter.log_image(path, name)
+            adapter.log_metrics(metrics_final)
+
+    def _get_logger_adapters(self) -> list:
+        """Get adapters with a common logging interface for all available loggers."""
+        adapters = []
         if self.comet_logger is not None:
-            self.comet_logger.log_image(img_path_data, name=f"A_final_plot{self.suffix}")
-            self.comet_logger.log_metrics(metrics_final)
+            adapters.append(CometAdapter(self.comet_logger))
         if self.wandb_logger is not None:
-            self.wandb_logger.log({f"A_final_plot{self.suffix}": wandb.Image(img_path_data)})
-            self.wandb_logger.log(metrics_final)
+            adapters.append(WandbAdapter(self.wandb_logger))
+        return adapters
 
     def _get_checkpoint(self, trainer: pl.Trainer, use_last_checkpoint: bool = True) -> None:
         """Get checkpoint path based on the selected checkpoint callback."""
@@ -29,6 +29,8 @@ def generate_data(
     verbose: bool = True,
     ode_solver: str = "dopri5_zuko",
     ode_steps: int = 100,
+    indices: np.ndarray = None,
+    out: np.ndarray = None,
 ):
     """Generate data with a model in batches and measure time.
 
@@ -48,27 +50,42 @@ def generate_data(
         verbose (bool, optional): Print generation progress. Defaults to True.
         ode_solver (str, optional): ODE solver for sampling. Defaults to "dopri5_zuko".
         ode_steps (int, optional): Number of steps for ODE solver. Defaults to 100.
+        indices (np.ndarray, optional): Indices into mask and cond for each generated jet, e.g. to reuse the same mask and cond several times without copying them. Defaults to None.
+        out (np.ndarray, optional): Preallocated array of shape (num_jet_samples, num_particles, num_features), e.g. a memory-mapped .npy file, into which each batch is written directly. Defaults to None.
 
     Raises:
         ValueError: _description_
 
     Returns:
-        np.array: sampled data of shape (num_jet_samples, num_particles, num_features) with features (eta, phi, pt)
+        np.array: sampled data of shape (num_jet_samples, num_particles, num_features) with features (eta, phi, pt). This is out if provided.
         float: generation time
     """
     if variable_set_sizes and mask is None:
         raise ValueError("Please use mask when using variable_set_sizes=True")
-    if len(mask) != num_jet_samples:
+    if indices is not None:
+        if len(indices) != num_jet_samples:
+            raise ValueError(
+                f"indices should have the same length as num_jet_samples ({len(indices)} != {num_jet_samples})"
+            )
+        indices = torch.as_tensor(indices, dtype=torch.long)
+    elif len(mask) != num_jet_samples:
         raise ValueError(
             f"Mask should have the same length as num_jet_samples ({len(mask)} != {num_jet_samples})"
         )
+    if out is not None and len(out) != num_jet_samples:
+        raise ValueError(
+            f"out should have the same length as num_jet_samples ({len(out)} != {num_jet_samples})"
+        )
     if verbose:
         print(f"Generating data. Device: {torch.device(device)}")
     particle_data_sampled = torch.Tensor()
     start_time = 0
     for i in tqdm(range(num_jet_samples // batch_size), disable=not verbose):
+        batch_indices = slice(i * batch_size, (i + 1) * batch_size)
+        if indices is not None:
+            batch_indices = indices[batch_indices]
         if cond is not None:
-            cond_batch = cond[i * batch_size : (i + 1) * batch_size]
+            cond_batch = cond[batch_indices]
         else:
             cond_batch = None
         if i == 1:
@@ -79,7 +96,7 @@ def generate_data(
                 mask = mask[permutation]
                 mask_batch = mask[:batch_size]
             else:
-                mask_batch = mask[i * batch_size : (i + 1) * batch_size]
+                mask_batch = mask[batch_indices]
         else:
             mask_batch = None
         with torch.no_grad():
@@ -100,14 +117,20 @@ def generate_data(
             )
         if variable_set_sizes:
             jet_samples_batch = jet_samples_batch * mask_batch
-        particle_data_sampled = torch.cat((particle_data_sampled, jet_samples_batch))
+        if out is not None:
+            out[i * batch_size : (i + 1) * batch_size] = jet_samples_batch.numpy()
+        else:
+            particle_data_sampled = torch.cat((particle_data_sampled, jet_samples_batch))
 
     end_time = time.time()
 
     if num_jet_samples % batch_size != 0:
         remaining_samples = num_jet_samples - (num_jet_samples // batch_size * batch_size)
+        batch_indices = slice(-remaining_samples, None)
+        if indices is not None:
+            batch_indices = indices[batch_indices]
         if cond is not None:
-            cond_batch = cond[-remaining_samples:]
+            cond_batch = cond[batch_indices]
         else:
             cond_batch = None
         if variable_set_sizes:
@@ -116,7 +139,7 @@ def generate_data(
                 mask = mask[permutation]
                 mask_batch = mask[-remaining_samples:]
             else:
-                mask_batch = mask[-remaining_samples:]
+                mask_batch = mask[batch_indices]
         else:
             mask_batch = None
         with torch.no_grad():
@@ -137,8 +160,16 @@ def generate_data(
             )
         if variable_set_sizes:
             jet_samples_batch = jet_samples_batch * mask_batch
-        particle_data_sampled = torch.cat((particle_data_sampled, jet_samples_batch))
+        if out is not None:
+            out[-remaining_samples:] = jet_samples_batch.numpy()
+        else:
+            particle_data_sampled = torch.cat((particle_data_sampled, jet_samples_batch))
 
-    particle_data_sampled = np.array(particle_data_sampled)
+    if out is not None:
+        if isinstance(out, np.memmap):
+            out.flush()
+        particle_data_sampled = out
+    else:
+        particle_data_sampled = np.array(particle_data_sampled)
     generation_time = end_time - start_time
     return particle_data_sampled, generation_time
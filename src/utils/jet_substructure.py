@@ -11,6 +11,7 @@ from pathlib import Path
 from typing import Union
 
 import h5py
+import hdf5plugin
 import matplotlib.pyplot as plt
 import numpy as np
 import pyjet
@@ -497,19 +498,27 @@ def dump_hlvs(
         d2s.append((ecf3 * sum_pt) / (ecf2**2))
 
     # Save all the data to an HDF file
+    # each variable is stored as a single Blosc2 compressed chunk for fast whole-column reads
+    # (chunks must not be larger than the data, so empty datasets are written without them)
+    dataset_kwargs = {}
+    if len(jets) > 0:
+        dataset_kwargs = dict(
+            chunks=(len(jets),),
+            **hdf5plugin.Blosc2(cname="lz4", clevel=1, filters=hdf5plugin.Blosc2.SHUFFLE),
+        )
     with h5py.File(h5file + ".h5", mode="w") as file:
-        file.create_dataset("tau1", data=tau_1s)
-        file.create_dataset("tau2", data=tau_2s)
-        file.create_dataset("tau3", data=tau_3s)
-        file.create_dataset("tau21", data=tau_21s)
-        file.create_dataset("tau32", data=tau_32s)
-        file.create_dataset("d12", data=d12s)
-        file.create_dataset("d23", data=d23s)
-        file.create_dataset("ecf2", data=ecf2s)
-        file.create_dataset("ecf3", data=ecf3s)
-        file.create_dataset("d2", data=d2s)
-        file.create_dataset("pt", data=pt)
-        file.create_dataset("mass", data=mass)
+        file.create_dataset("tau1", data=tau_1s, **dataset_kwargs)
+        file.create_dataset("tau2", data=tau_2s, **dataset_kwargs)
+        file.create_dataset("tau3", data=tau_3s, **dataset_kwargs)
+        file.create_dataset("tau21", data=tau_21s, **dataset_kwargs)
+        file.create_dataset("tau32", data=tau_32s, **dataset_kwargs)
+        file.create_dataset("d12", data=d12s, **dataset_kwargs)
+        file.create_dataset("d23", data=d23s, **dataset_kwargs)
+        file.create_dataset("ecf2", data=ecf2s, **dataset_kwargs)
+        file.create_dataset("ecf3", data=ecf3s, **dataset_kwargs)
+        file.create_dataset("d2", data=d2s, **dataset_kwargs)
+        file.create_dataset("pt", data=pt, **dataset_kwargs)
+        file.create_dataset("mass", data=mass, **dataset_kwargs)
 
     # Include some plots
     if plot:
@@ -119,8 +119,8 @@ def plot_data(
         particle_data (list): List of data to be plotted. Can be an empty list. shape: (num_dataset,num_samples,particles,features)
         jet_data_sim (np.ndarray): Jet data of the reference data.
         jet_data (list): Jet data of the data to be plotted.
-        efps_sim (np.ndarray): EFPs of the reference data.
-        efps_values (list): EFPS of the data to be plotted.
+        efps_sim (np.ndarray): EFPs of the reference data. Can be None if plot_efps is False.
+        efps_values (list): EFPS of the data to be plotted. Can be None if plot_efps is False.
         num_samples (int, optional): Number of samples to be plotted. Defaults to length of first dataset in particle_data.
         labels (list): Labels of the plot to describe the data.
         sim_data_label (str, optional): Label of the plot for the reference data. Defaults to "Sim. data".
@@ -174,8 +174,9 @@ def plot_data(
     particle_data = particle_data[:, :num_samples]
     jet_data_sim = jet_data_sim[:num_samples]
     jet_data = jet_data[:, :num_samples]
-    efps_sim = efps_sim[:num_samples]
-    efps_values = efps_values[:, :num_samples]
+    if plot_efps:
+        efps_sim = efps_sim[:num_samples]
+        efps_values = efps_values[:, :num_samples]
 
     particles_per_jet = sim_data.shape[-2]
 
@@ -0,0 +1,77 @@
+import numpy as np
+import torch
+
+from src.utils.data_generation import generate_data
+
+NUM_PARTICLES = 5
+NUM_FEATURES = 3
+
+
+class DummyModel:
+    """Model whose samples encode the conditioning, so the generated order can be checked."""
+
+    def to(self, device):
+        return self
+
+    def sample(self, n_samples, cond, mask, ode_solver=None, ode_steps=None):
+        return torch.ones(n_samples, NUM_PARTICLES, NUM_FEATURES) * cond[:, None, None]
+
+
+def _get_cond_and_mask(num_jets: int):
+    cond = np.arange(1, num_jets + 1, dtype=np.float32)
+    num_particles = np.arange(num_jets) % NUM_PARTICLES + 1
+    mask = (np.arange(NUM_PARTICLES)[None, :] < num_particles[:, None]).astype(np.float32)
+    return cond, mask[..., None]
+
+
+def test_generate_data_indices_match_repeated_arrays():
+    num_jets, multiplier, batch_size = 10, 3, 4
+    cond, mask = _get_cond_and_mask(num_jets)
+
+    expected, _ = generate_data(
+        DummyModel(),
+        num_jet_samples=num_jets * multiplier,
+        batch_size=batch_size,
+        cond=torch.from_numpy(np.repeat(cond, multiplier, axis=0)),
+        device="cpu",
+        variable_set_sizes=True,
+        mask=torch.from_numpy(np.repeat(mask, multiplier, axis=0)),
+        verbose=False,
+    )
+    data, _ = generate_data(
+        DummyModel(),
+        num_jet_samples=num_jets * multiplier,
+        batch_size=batch_size,
+        cond=torch.from_numpy(cond),
+        device="cpu",
+        variable_set_sizes=True,
+        mask=torch.from_numpy(mask),
+        indices=np.repeat(np.arange(num_jets), multiplier),
+        verbose=False,
+    )
+
+    assert data.shape == (num_jets * multiplier, NUM_PARTICLES, NUM_FEATURES)
+    np.testing.assert_array_equal(data, expected)
+
+
+def test_generate_data_fills_out_with_remainder_batch():
+    num_jets, batch_size = 10, 4
+    cond, mask = _get_cond_and_mask(num_jets)
+    out = np.full((num_jets, NUM_PARTICLES, NUM_FEATURES), np.nan, dtype=np.float32)
+
+    data, _ = generate_data(
+        DummyModel(),
+        num_jet_samples=num_jets,
+        batch_size=batch_size,
+        cond=torch.from_numpy(cond),
+        device="cpu",
+        variable_set_sizes=True,
+        mask=torch.from_numpy(mask),
+        out=out,
+        verbose=False,
+    )
+
+    assert data is out
+    assert not np.isnan(out).any()
+    expected = np.ones((num_jets, NUM_PARTICLES, NUM_FEATURES), np.float32) * cond[:, None, None]
+    np.testing.assert_array_equal(out, expected * mask)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import torch
+from scipy.stats import wasserstein_distance
+
+from src.data.components.metrics import (
+    wasserstein_distance_1d,
+    wasserstein_distance_1d_torch,
+)
+
+
+@pytest.mark.parametrize("parallel", [True, False])
+def test_wasserstein_distance_1d_equal_size(parallel):
+    rng = np.random.default_rng(0)
+    u = rng.normal(size=(4, 1000))
+    v = rng.normal(loc=0.3, scale=1.5, size=(4, 1000))
+
+    w1 = wasserstein_distance_1d(u, v, parallel=parallel)
+
+    assert w1.shape == (4,)
+    expected = [wasserstein_distance(u_row, v_row) for u_row, v_row in zip(u, v)]
+    np.testing.assert_allclose(w1, expected, rtol=1e-10)
+
+
+def test_wasserstein_distance_1d_unequal_size():
+    rng = np.random.default_rng(1)
+    u = rng.normal(size=(4, 700))
+    v = rng.exponential(size=(4, 1100))
+
+    w1 = wasserstein_distance_1d(u, v)
+
+    assert w1.shape == (4,)
+    expected = [wasserstein_distance(u_row, v_row) for u_row, v_row in zip(u, v)]
+    np.testing.assert_allclose(w1, expected, rtol=1e-10)
+
+
+def test_wasserstein_distance_1d_single_batch():
+    rng = np.random.default_rng(2)
+    u = rng.normal(size=500)
+    v = rng.normal(loc=1.0, size=500)
+
+    w1 = wasserstein_distance_1d(u, v)
+
+    assert w1.shape == ()
+    assert float(w1) == pytest.approx(wasserstein_distance(u, v), rel=1e-10)
+
+
+def test_wasserstein_distance_1d_torch():
+    rng = np.random.default_rng(3)
+    u = rng.normal(size=(4, 1000))
+    v = rng.normal(loc=-0.5, scale=0.7, size=(4, 1000))
+
+    w1 = wasserstein_distance_1d_torch(torch.from_numpy(u), torch.from_numpy(v))
+
+    assert w1.shape == (4,)
+    expected = [wasserstein_distance(u_row, v_row) for u_row, v_row in zip(u, v)]
+    np.testing.assert_allclose(w1.numpy(), expected, rtol=1e-10)